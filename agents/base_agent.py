@@ -1,6 +1,28 @@
+import pandas as pd
+
+
 class BaseAgent:
     def __init__(self) -> None:
         pass
 
     def run(self):
         pass
+
+    @staticmethod
+    def _prepare_df(df: pd.DataFrame) -> pd.DataFrame:
+        # 已按日期排好序、索引为RangeIndex的数据直接使用，不再复制；
+        # 下游只读不写，调用方的数据不会被修改
+        if "date" in df.columns:
+            if not df["date"].is_monotonic_increasing:
+                df = df.sort_values("date")
+            if not df.index.equals(pd.RangeIndex(len(df))):
+                df = df.reset_index(drop=True)
+        else:
+            df = df.assign(date=df.index).reset_index(drop=True)
+        # 日期统一转成datetime64，下游直接做向量化的日期运算
+        if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+            df = df.assign(date=pd.to_datetime(df["date"], cache=True))
+        for col in ["open", "high", "low", "close", "volume"]:
+            if col not in df.columns:
+                raise ValueError(f"DataFrame missing required column: {col}")
+        return df
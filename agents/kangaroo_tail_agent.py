@@ -1,10 +1,130 @@
 from typing import List, Dict
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 
 from agents.base_agent import BaseAgent
-from data.wind_utils import get_data_in_range
+from data.wind_utils import get_batch_in_range
+from utils._njit import NUMBA_AVAILABLE, njit
+
+
+EPS = 1e-9
+
+
+@njit(cache=True)
+def _kangaroo_kernel(
+    o, h, l, c, N, tail_is_lower, tail_min_ratio, body_max_ratio, trend_required
+):
+    n = c.shape[0]
+    mask = np.zeros(n, dtype=np.bool_)
+    body = np.empty(n)
+    upper = np.empty(n)
+    lower = np.empty(n)
+    full = np.empty(n)
+
+    # 下影线/上影线与下跌/上涨趋势在循环外确定，循环内不再分支
+    tail = lower if tail_is_lower else upper
+    trend_sign = -1.0 if tail_is_lower else 1.0
+
+    for i in range(n):
+        top = c[i] if c[i] > o[i] else o[i]
+        bottom = c[i] if c[i] < o[i] else o[i]
+        body[i] = abs(c[i] - o[i])
+        upper[i] = max(h[i] - top, 0.0)
+        lower[i] = max(bottom - l[i], 0.0)
+        fr = h[i] - l[i]
+        full[i] = EPS if fr < EPS else fr
+
+        # 最近N天的平均full_range，从旧到新逐个累加；窗口内有NaN时均值为NaN，不做2倍过滤
+        window = i if i < N else N
+        if window == 0:
+            avg_range = EPS  # 避免除零
+        else:
+            range_sum = 0.0
+            for k in range(i - window, i):
+                range_sum += full[k]
+            avg_range = range_sum / window
+
+        # 当前K线含NaN时body/full为NaN，第二个条件不成立，不会产生信号
+        ok = (
+            not full[i] < 2 * avg_range
+            and body[i] / full[i] <= body_max_ratio
+            and tail[i] >= tail_min_ratio * max(body[i], EPS)
+            and tail[i] / full[i] >= 0.4
+        )
+        if ok and trend_required:
+            # 前N天收盘价的日均变化（共N-1个差分，跳过NaN）
+            drift_sum = 0.0
+            drift_cnt = 0
+            if i >= N:
+                for k in range(i - N + 1, i):
+                    d = c[k] - c[k - 1]
+                    if d == d:
+                        drift_sum += d
+                        drift_cnt += 1
+            if drift_cnt == 0:
+                ok = False
+            else:
+                ok = trend_sign * (drift_sum / drift_cnt) > 0
+        mask[i] = ok
+
+    return mask, body, upper, lower, full
+
+
+def _kangaroo_vectorized(
+    o, h, l, c, N, tail_is_lower, tail_min_ratio, body_max_ratio, trend_required
+):
+    body = np.abs(c - o)
+    upper = np.maximum(h - np.maximum(c, o), 0)
+    lower = np.maximum(np.minimum(c, o) - l, 0)
+    full = np.maximum(h - l, EPS)
+
+    # 计算最近N天的平均full_range（不包括当前idx），第一根K线用eps避免除零
+    # N很小，按从旧到新的顺序逐个叠加平移后的切片，与逐窗口求和的结果完全一致；
+    # 窗口内有NaN时均值为NaN，不做2倍过滤
+    n = full.shape[0]
+    valid = ~np.isnan(full)
+    finite_full = np.where(valid, full, 0.0)
+    range_sum = np.zeros(n)
+    for k in range(N, 0, -1):
+        range_sum[k:] += finite_full[:-k]
+    cnan = np.concatenate(([0], np.cumsum(~valid)))
+    idx = np.arange(n)
+    start = np.maximum(idx - N, 0)
+    window = idx - start
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_range = range_sum / window
+    avg_range[cnan[idx] > cnan[start]] = np.nan
+    avg_range[window == 0] = EPS
+
+    tail = lower if tail_is_lower else upper
+
+    # 当前full_range要至少是平均的2倍；当前K线含NaN时body/full为NaN，不会产生信号
+    mask = ~(full < 2 * avg_range)
+    mask &= body / full <= body_max_ratio
+    mask &= tail >= tail_min_ratio * np.maximum(body, EPS)
+    mask &= tail / full >= 0.4
+
+    if trend_required:
+        # 前N天收盘价的日均变化（共N-1个差分，跳过NaN），不足N天则不判断为趋势
+        diffs = np.diff(c)
+        valid = ~np.isnan(diffs)
+        dsum = np.concatenate(([0.0], np.cumsum(np.where(valid, diffs, 0.0))))
+        dcnt = np.concatenate(([0], np.cumsum(valid)))
+        diff_mean = np.full(c.shape[0], np.nan)
+        if N >= 2 and c.shape[0] > N:
+            end = np.arange(N, c.shape[0]) - 1
+            with np.errstate(invalid="ignore", divide="ignore"):
+                diff_mean[N:] = (dsum[end] - dsum[end - N + 1]) / (
+                    dcnt[end] - dcnt[end - N + 1]
+                )
+        mask &= diff_mean < 0 if tail_is_lower else diff_mean > 0
+
+    return mask, body, upper, lower, full
+
+
+_kangaroo_features = _kangaroo_kernel if NUMBA_AVAILABLE else _kangaroo_vectorized
 
 
 class KangarooTailAgent(BaseAgent):
@@ -29,136 +149,82 @@ class KangarooTailAgent(BaseAgent):
         self.trend_required = trend_required
         self.fetch_window = fetch_window
 
-    @staticmethod
-    def _prepare_df(df: pd.DataFrame) -> pd.DataFrame:
-        df = df.copy()
-        if "date" in df.columns:
-            df = df.sort_values("date").reset_index(drop=True)
-        else:
-            df = df.reset_index().rename(columns={"index": "date"})
-        for c in ["open", "high", "low", "close", "volume"]:
-            if c not in df.columns:
-                raise ValueError(f"data frame missing required column: {c}")
-        return df
-
-    def _is_downtrend(self, prices: pd.Series) -> bool:
-        if len(prices) < self.min_trend_days:
-            return False
-        diffs = prices.diff().dropna()
-        return diffs.mean() < 0
-
-    def _is_uptrend(self, prices: pd.Series) -> bool:
-        if len(prices) < self.min_trend_days:
-            return False
-        diffs = prices.diff().dropna()
-        return diffs.mean() > 0
-
     def detect_signals(self, df: pd.DataFrame) -> List[Dict]:
-        df = self._prepare_df(df)
-        signals = []
-        eps = 1e-9
-        N = self.min_trend_days
-
-        for idx, row in df.iterrows():
-            o, h, l, c = (
-                float(row["open"]),
-                float(row["high"]),
-                float(row["low"]),
-                float(row["close"]),
-            )
-            body = abs(c - o)
-            upper_shadow = max(h - max(c, o), 0)
-            lower_shadow = max(min(c, o) - l, 0)
-            full_range = max(h - l, eps)
-
-            # 计算最近N天的平均full_range（不包括当前idx）
-            start_idx = max(0, idx - N)
-            recent_ranges = []
-            for i in range(start_idx, idx):
-                hr = float(df.loc[i, "high"])
-                lr = float(df.loc[i, "low"])
-                recent_ranges.append(max(hr - lr, eps))
-            if len(recent_ranges) == 0:
-                avg_range = eps  # 避免除零
-            else:
-                avg_range = sum(recent_ranges) / len(recent_ranges)
+        return self._detect_on_prepared(self._prepare_df(df))
 
-            # 当前full_range要至少是平均的2倍
-            if full_range < 2 * avg_range:
-                continue
+    def detect_signals_last(self, df: pd.DataFrame) -> List[Dict]:
+        """
+        只检测最后一根K线，结果与detect_signals中idx为最后一根的信号一致。
+        """
+        return self._detect_last_on_prepared(self._prepare_df(df))
 
-            if body / full_range > self.body_max_ratio:
-                continue
+    def _detect_on_prepared(self, df: pd.DataFrame) -> List[Dict]:
+        tail_type = self.tail_type
 
-            if self.tail_type == "lower":
-                if lower_shadow < self.tail_min_ratio * max(body, eps):
-                    continue
-                if lower_shadow / full_range < 0.4:
-                    continue
-                if self.trend_required:
-                    prev_closes = df["close"].iloc[
-                        max(0, idx - self.min_trend_days) : idx
-                    ]
-                    if not self._is_downtrend(prev_closes):
-                        continue
-                signals.append(
-                    {
-                        "date": df.loc[idx, "date"],
-                        "type": "lower",
-                        "body": body,
-                        "lower_shadow": lower_shadow,
-                        "upper_shadow": upper_shadow,
-                        "full_range": full_range,
-                        "close": c,
-                        "open": o,
-                        "idx": idx,
-                    }
-                )
+        # 逐列取出连续的float64数组，直接交给kernel，不做逐行的float()转换
+        o, h, l, c = (
+            np.ascontiguousarray(df[col].to_numpy(dtype=np.float64))
+            for col in ("open", "high", "low", "close")
+        )
+        mask, body, upper_shadow, lower_shadow, full_range = _kangaroo_features(
+            o,
+            h,
+            l,
+            c,
+            self.min_trend_days,
+            tail_type == "lower",
+            self.tail_min_ratio,
+            self.body_max_ratio,
+            self.trend_required,
+        )
 
-            else:  # upper
-                if upper_shadow < self.tail_min_ratio * max(body, eps):
-                    continue
-                if upper_shadow / full_range < 0.4:
-                    continue
-                if self.trend_required:
-                    prev_closes = df["close"].iloc[
-                        max(0, idx - self.min_trend_days) : idx
-                    ]
-                    if not self._is_uptrend(prev_closes):
-                        continue
-                signals.append(
-                    {
-                        "date": df.loc[idx, "date"],
-                        "type": "upper",
-                        "body": body,
-                        "lower_shadow": lower_shadow,
-                        "upper_shadow": upper_shadow,
-                        "full_range": full_range,
-                        "close": c,
-                        "open": o,
-                        "idx": idx,
-                    }
-                )
+        days = df["date"].to_numpy(dtype="datetime64[D]")
+        signals = []
+        for idx in np.flatnonzero(mask):
+            signals.append(
+                {
+                    "date": str(days[idx]),
+                    "type": tail_type,
+                    "body": float(body[idx]),
+                    "lower_shadow": float(lower_shadow[idx]),
+                    "upper_shadow": float(upper_shadow[idx]),
+                    "full_range": float(full_range[idx]),
+                    "close": float(c[idx]),
+                    "open": float(o[idx]),
+                    "idx": int(idx),
+                }
+            )
         return signals
 
+    def _detect_last_on_prepared(self, df: pd.DataFrame) -> List[Dict]:
+        # 最后一根K线只依赖它前面的N根K线（平均full_range和趋势），只在这段上计算
+        last_idx = len(df) - 1
+        offset = max(0, last_idx - self.min_trend_days)
+        signals = self._detect_on_prepared(df.iloc[offset:])
+        return [dict(s, idx=last_idx) for s in signals if s["idx"] + offset == last_idx]
+
+    def _run_one(self, df: pd.DataFrame) -> List[Dict]:
+        if df is None or len(df) == 0:
+            return []
+        return self._detect_last_on_prepared(self._prepare_df(df))
+
     def run(self, current_date: str = None) -> Dict[str, List[Dict]]:
         results = {}
+        try:
+            start_date = (
+                datetime.strptime(current_date, "%Y-%m-%d")
+                - timedelta(days=self.fetch_window)
+            ).strftime("%Y-%m-%d")
+            frames = get_batch_in_range(
+                self.universe, start_date=start_date, end_date=current_date
+            )
+        except Exception:
+            return results
         for sym in self.universe:
             try:
-                start_date = (
-                    datetime.strptime(current_date, "%Y-%m-%d")
-                    - timedelta(days=self.fetch_window)
-                ).strftime("%Y-%m-%d")
-                df = get_data_in_range(
-                    sym, start_date=start_date, end_date=current_date
-                )
-                if df is None or len(df) == 0:
-                    continue
-                signals = self.detect_signals(df)
-                if signals:
-                    today_signals = [s for s in signals if s["idx"] == len(df) - 1]
-                    if today_signals:
-                        results[sym] = today_signals
+                today_signals = self._run_one(frames.get(sym))
             except Exception:
                 continue
+            if today_signals:
+                results[sym] = today_signals
         return results
@@ -4,14 +4,89 @@ import logging
 
 import pandas as pd
 import numpy as np
-from scipy.signal import argrelextrema
 
 from agents.base_agent import BaseAgent
-from data.wind_utils import get_data_in_range
+from data.wind_utils import get_batch_in_range
+from utils._njit import NUMBA_AVAILABLE, njit
 
 
 logger = logging.getLogger(__name__)
 
+# 寻找局部极值点时两侧比较的K线数
+EXTREMA_ORDER = 3
+
+
+@njit(cache=True)
+def _ewma_step(weighted, old_wt, cur, alpha):
+    """
+    pandas ``ewm(adjust=False, ignore_na=False).mean()`` 的单步递推，
+    初始状态为 ``weighted=nan, old_wt=1.0``。
+    """
+    if weighted == weighted:
+        old_wt *= 1.0 - alpha
+        if cur == cur:
+            if weighted != cur:
+                weighted = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+            old_wt = 1.0
+    elif cur == cur:
+        weighted = cur
+    return weighted, old_wt
+
+
+@njit(cache=True)
+def _macd_fused(close, short_window, long_window, signal_window):
+    """
+    单次遍历close同时计算短、长EMA及DEA，返回 (diff, dea, hist)。
+    """
+    a_s = 2.0 / (short_window + 1.0)
+    a_l = 2.0 / (long_window + 1.0)
+    a_g = 2.0 / (signal_window + 1.0)
+    n = close.shape[0]
+    diff = np.empty(n)
+    dea = np.empty(n)
+    hist = np.empty(n)
+    es, wt_s = np.nan, 1.0
+    el, wt_l = np.nan, 1.0
+    eg, wt_g = np.nan, 1.0
+    for i in range(n):
+        x = close[i]
+        es, wt_s = _ewma_step(es, wt_s, x, a_s)
+        el, wt_l = _ewma_step(el, wt_l, x, a_l)
+        d = es - el
+        eg, wt_g = _ewma_step(eg, wt_g, d, a_g)
+        diff[i] = d
+        dea[i] = eg
+        hist[i] = d - eg
+    return diff, dea, hist
+
+
+@njit(cache=True)
+def _local_extrema(a, order, find_min):
+    """
+    单次遍历寻找局部极值点，语义与 ``argrelextrema(a, np.less_equal/np.greater_equal,
+    order=order)`` 一致：越界的邻居按边界值处理（mode="clip"），因此首尾K线也可能是极值点。
+    """
+    n = a.shape[0]
+    out = np.empty(n, dtype=np.int64)
+    k = 0
+    for i in range(n):
+        v = a[i]
+        ok = True
+        for j in range(1, order + 1):
+            left = a[max(i - j, 0)]
+            right = a[min(i + j, n - 1)]
+            if find_min:
+                if not (v <= left and v <= right):
+                    ok = False
+                    break
+            elif not (v >= left and v >= right):
+                ok = False
+                break
+        if ok:
+            out[k] = i
+            k += 1
+    return out[:k]
+
 
 class MACDDivergenceAgent(BaseAgent):
     def __init__(
@@ -31,18 +106,20 @@ class MACDDivergenceAgent(BaseAgent):
         self.min_gap_days = min_gap_days
         self.fetch_window = fetch_window
 
-    def _prepare_df(self, df: pd.DataFrame) -> pd.DataFrame:
-        df = df.copy()
-        if "date" in df.columns:
-            df = df.sort_values("date").reset_index(drop=True)
-        else:
-            df = df.reset_index().rename(columns={"index": "date"})
-        for col in ["open", "high", "low", "close", "volume"]:
-            if col not in df.columns:
-                raise ValueError(f"DataFrame missing required column: {col}")
-        return df
-
     def _calc_macd(self, close: pd.Series):
+        if NUMBA_AVAILABLE:
+            diff, dea, hist = _macd_fused(
+                np.ascontiguousarray(close.to_numpy(dtype=np.float64)),
+                self.short_window,
+                self.long_window,
+                self.signal_window,
+            )
+            return (
+                pd.Series(diff, index=close.index),
+                pd.Series(dea, index=close.index),
+                pd.Series(hist, index=close.index),
+            )
+
         ema_short = close.ewm(span=self.short_window, adjust=False).mean()
         ema_long = close.ewm(span=self.long_window, adjust=False).mean()
         diff = ema_short - ema_long
@@ -54,10 +131,20 @@ class MACDDivergenceAgent(BaseAgent):
         self, series: pd.Series, order: int = 3, mode: str = "min"
     ) -> np.ndarray:
         """
-        使用scipy的argrelextrema寻找局部极值点，返回索引数组。
+        寻找局部极值点，返回索引数组。
         order参数决定窗口大小。
         mode=="min"找局部最小值，"max"找局部最大值。
+        未安装numba时退回scipy的argrelextrema。
         """
+        if NUMBA_AVAILABLE:
+            return _local_extrema(
+                np.ascontiguousarray(series.to_numpy(dtype=np.float64)),
+                order,
+                mode == "min",
+            )
+
+        from scipy.signal import argrelextrema
+
         if mode == "min":
             idxs = argrelextrema(series.values, np.less_equal, order=order)[0]
         else:
@@ -65,100 +152,149 @@ class MACDDivergenceAgent(BaseAgent):
         return idxs
 
     def detect_signals(self, df: pd.DataFrame) -> List[Dict]:
-        df = self._prepare_df(df)
-        df["macd_diff"], df["macd_dea"], df["macd_hist"] = self._calc_macd(df["close"])
+        return self._detect_on_prepared(self._prepare_df(df))
 
-        signals = []
+    def detect_signals_last(self, df: pd.DataFrame) -> List[Dict]:
+        """
+        只检测最后一根K线上的背离信号，结果与detect_signals中idx为最后一根的信号一致。
+        """
+        return self._detect_last_on_prepared(self._prepare_df(df))
+
+    def _detect_on_prepared(self, df: pd.DataFrame) -> List[Dict]:
+        _, _, hist = self._calc_macd(df["close"])
+
+        # 一次性取出numpy数组，循环中按位置索引
+        closes = df["close"].to_numpy(dtype=np.float64)
+        hist = hist.to_numpy(dtype=np.float64)
+        days = df["date"].to_numpy(dtype="datetime64[D]")
 
         # 找局部低点（价格最低点）和高点
-        low_idxs = self._find_local_extrema(df["close"], order=3, mode="min")
-        high_idxs = self._find_local_extrema(df["close"], order=3, mode="max")
+        low_idxs = self._find_local_extrema(
+            df["close"], order=EXTREMA_ORDER, mode="min"
+        )
+        high_idxs = self._find_local_extrema(
+            df["close"], order=EXTREMA_ORDER, mode="max"
+        )
+        return self._find_divergences(closes, hist, days, low_idxs, high_idxs)
 
-        # 底背离检测：
-        # 连续两个局部低点，第二个低点价格更低，但MACD柱状图对应低点抬高（背离）
-        for i in range(len(low_idxs) - 1):
-            idx1, idx2 = low_idxs[i], low_idxs[i + 1]
+    def _detect_last_on_prepared(self, df: pd.DataFrame) -> List[Dict]:
+        closes = df["close"].to_numpy(dtype=np.float64)
+        last_idx = len(closes) - 1
 
-            date1 = pd.to_datetime(df.loc[idx1, "date"])
-            date2 = pd.to_datetime(df.loc[idx2, "date"])
-            if (date2 - date1).days < self.min_gap_days:
-                continue
+        # 最后一根K线不是局部极值点时不可能出现当天的背离，跳过MACD计算
+        recent = closes[max(0, last_idx - EXTREMA_ORDER) :]
+        is_low = bool(np.all(closes[last_idx] <= recent))
+        is_high = bool(np.all(closes[last_idx] >= recent))
+        if not (is_low or is_high):
+            return []
+
+        _, _, hist = self._calc_macd(df["close"])
+        days = df["date"].to_numpy(dtype="datetime64[D]")
+
+        # 只需比较最后两个极值点
+        no_idxs = np.empty(0, dtype=np.int64)
+        low_idxs = (
+            self._find_local_extrema(df["close"], order=EXTREMA_ORDER, mode="min")[-2:]
+            if is_low
+            else no_idxs
+        )
+        high_idxs = (
+            self._find_local_extrema(df["close"], order=EXTREMA_ORDER, mode="max")[-2:]
+            if is_high
+            else no_idxs
+        )
+        return self._find_divergences(
+            closes, hist.to_numpy(), days, low_idxs, high_idxs
+        )
+
+    def _find_divergences(
+        self,
+        closes: np.ndarray,
+        hist: np.ndarray,
+        days: np.ndarray,
+        low_idxs: np.ndarray,
+        high_idxs: np.ndarray,
+    ) -> List[Dict]:
+        signals = []
 
-            price1, price2 = df.loc[idx1, "close"], df.loc[idx2, "close"]
-            hist1, hist2 = df.loc[idx1, "macd_hist"], df.loc[idx2, "macd_hist"]
-
-            # 底背离条件：价格创新低，但macd_hist却抬高
-            if price2 < price1 and hist2 > hist1:
-                signals.append(
-                    {
-                        "date": df.loc[idx2, "date"],
-                        "type": "bullish_divergence",
-                        "price1": float(price1),
-                        "price2": float(price2),
-                        "macd_hist1": float(hist1),
-                        "macd_hist2": float(hist2),
-                        "idx": idx2,
-                    }
-                )
+        # 底背离检测：
+        # 连续两个局部低点，第二个低点价格更低，但MACD柱状图对应低点抬高（背离）
+        i1, i2 = low_idxs[:-1], low_idxs[1:]
+        gap = (days[i2] - days[i1]).astype(int)
+        mask = (
+            (gap >= self.min_gap_days)
+            & (closes[i2] < closes[i1])
+            & (hist[i2] > hist[i1])
+        )
+        for idx1, idx2 in zip(i1[mask], i2[mask]):
+            signals.append(
+                {
+                    "date": str(days[idx2]),
+                    "type": "bullish_divergence",
+                    "price1": float(closes[idx1]),
+                    "price2": float(closes[idx2]),
+                    "macd_hist1": float(hist[idx1]),
+                    "macd_hist2": float(hist[idx2]),
+                    "idx": idx2,
+                }
+            )
 
         # 顶背离检测：
         # 连续两个局部高点，第二个高点价格更高，但MACD柱状图对应高点降低（背离）
-        for i in range(len(high_idxs) - 1):
-            idx1, idx2 = high_idxs[i], high_idxs[i + 1]
+        i1, i2 = high_idxs[:-1], high_idxs[1:]
+        gap = (days[i2] - days[i1]).astype(int)
+        mask = (
+            (gap >= self.min_gap_days)
+            & (closes[i2] > closes[i1])
+            & (hist[i2] < hist[i1])
+        )
+        for idx1, idx2 in zip(i1[mask], i2[mask]):
+            signals.append(
+                {
+                    "date": str(days[idx2]),
+                    "type": "bearish_divergence",
+                    "price1": float(closes[idx1]),
+                    "price2": float(closes[idx2]),
+                    "macd_hist1": float(hist[idx1]),
+                    "macd_hist2": float(hist[idx2]),
+                    "idx": idx2,
+                }
+            )
 
-            date1 = pd.to_datetime(df.loc[idx1, "date"])
-            date2 = pd.to_datetime(df.loc[idx2, "date"])
-            if (date2 - date1).days < self.min_gap_days:
-                continue
+        return signals
 
-            price1, price2 = df.loc[idx1, "close"], df.loc[idx2, "close"]
-            hist1, hist2 = df.loc[idx1, "macd_hist"], df.loc[idx2, "macd_hist"]
-
-            # 顶背离条件：价格创新高，但macd_hist降低
-            if price2 > price1 and hist2 < hist1:
-                signals.append(
-                    {
-                        "date": df.loc[idx2, "date"],
-                        "type": "bearish_divergence",
-                        "price1": float(price1),
-                        "price2": float(price2),
-                        "macd_hist1": float(hist1),
-                        "macd_hist2": float(hist2),
-                        "idx": idx2,
-                    }
-                )
+    def _run_one(self, df: pd.DataFrame) -> List[Dict]:
+        if df is None or len(df) == 0:
+            return []
 
-        return signals
+        # 只检测当天最新的信号
+        return self._detect_last_on_prepared(self._prepare_df(df))
 
     def run(self, current_date: str = None) -> Dict[str, List[Dict]]:
         results = {}
         if current_date is None:
             current_date = datetime.now().strftime("%Y-%m-%d")
 
+        start_dt = datetime.strptime(current_date, "%Y-%m-%d") - timedelta(
+            days=self.fetch_window
+        )
+        start_date = start_dt.strftime("%Y-%m-%d")
+        # 整个universe批量拉取，避免逐个代码请求Wind
+        try:
+            frames = get_batch_in_range(
+                self.universe, start_date=start_date, end_date=current_date
+            )
+        except Exception as e:
+            logger.exception(f"Error fetching universe: {e}")
+            return results
+
         for sym in self.universe:
             try:
-                start_dt = datetime.strptime(current_date, "%Y-%m-%d") - timedelta(
-                    days=self.fetch_window
-                )
-                start_date = start_dt.strftime("%Y-%m-%d")
-                # 需要你实现或替换get_data_in_range函数
-                df = get_data_in_range(
-                    sym, start_date=start_date, end_date=current_date
-                )
-                if df is None or len(df) == 0:
-                    continue
-
-                signals = self.detect_signals(df)
-                if signals:
-                    # 只保留当天最新的信号
-                    df_prepared = self._prepare_df(df)
-                    last_idx = len(df_prepared) - 1
-                    today_signals = [s for s in signals if s["idx"] == last_idx]
-                    if today_signals:
-                        results[sym] = today_signals
-
+                today_signals = self._run_one(frames.get(sym))
             except Exception as e:
                 logger.exception(f"Error processing {sym}: {e}")
                 continue
+            if today_signals:
+                results[sym] = today_signals
 
         return results
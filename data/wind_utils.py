@@ -1,12 +1,86 @@
 import sys
-from typing import List, Optional
+import time
+import hashlib
+import logging
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Optional
 import pandas as pd
 
-sys.path.append("/Applications/Wind API.app/Contents/python")
+logger = logging.getLogger(__name__)
 
-from WindPy import w
+WIND_MAC_PATH = "/Applications/Wind API.app/Contents/python"
 
-w.start()
+_W = None
+
+
+def _wind():
+    """
+    延迟导入并启动WindPy，只有真正需要请求Wind（如缓存未命中）时才付出启动开销。
+    """
+    global _W
+    if _W is None:
+        if sys.platform == "darwin" and WIND_MAC_PATH not in sys.path:
+            sys.path.append(WIND_MAC_PATH)
+        from WindPy import w
+
+        w.start()
+        _W = w
+    return _W
+
+
+DEFAULT_INDICATORS = [
+    "high",
+    "open",
+    "low",
+    "close",
+    "volume",
+    "amt",
+    "vwap",
+    "adjfactor",
+]
+
+# 本地parquet缓存，避免重复运行时对同一窗口重复请求Wind
+CACHE_DIR = Path(".cache")
+CACHE_TTL = 12 * 60 * 60  # 秒
+
+
+def _cache_path(
+    instrument: str, start_date: str, end_date: str, indicators: List[str], options: str
+) -> Optional[Path]:
+    # 窗口包含今天时当天的K线还没收盘，不缓存
+    if not end_date or end_date >= date.today().strftime("%Y-%m-%d"):
+        return None
+    key = f"{instrument}|{start_date}|{end_date}|{','.join(indicators)}|{options}"
+    return CACHE_DIR / f"{hashlib.md5(key.encode()).hexdigest()}.parquet"
+
+
+def _read_cache(path: Optional[Path]) -> Optional[pd.DataFrame]:
+    # 缓存只用来加速，任何读取失败都当作未命中
+    if path is None:
+        return None
+    try:
+        if time.time() - path.stat().st_mtime > CACHE_TTL:
+            return None
+        return pd.read_parquet(path)
+    except Exception:
+        return None
+
+
+def _write_cache(path: Optional[Path], df: pd.DataFrame) -> None:
+    # 写缓存失败（未安装pyarrow/fastparquet、目录不可写等）时直接放弃，不影响返回结果
+    if path is None:
+        return
+    tmp_path = path.with_suffix(".tmp")
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(tmp_path, compression="zstd")
+        tmp_path.replace(path)
+    except Exception:
+        try:
+            tmp_path.unlink(missing_ok=True)
+        except OSError:
+            pass
 
 
 def get_data_in_range(
@@ -35,21 +109,18 @@ def get_data_in_range(
     Returns
     -------
     pd.DataFrame or None
-        DataFrame with Date index and requested indicators, or None if failed.
+        DataFrame with a DatetimeIndex named 'date' and requested indicators,
+        or None if failed.
     """
     if indicators is None:
-        indicators = [
-            "high",
-            "open",
-            "low",
-            "close",
-            "volume",
-            "amt",
-            "vwap",
-            "adjfactor",
-        ]
-
-    data = w.wsd(instrument, ",".join(indicators), start_date, end_date, options)
+        indicators = DEFAULT_INDICATORS
+
+    cache_path = _cache_path(instrument, start_date, end_date, indicators, options)
+    cached = _read_cache(cache_path)
+    if cached is not None:
+        return cached
+
+    data = _wind().wsd(instrument, ",".join(indicators), start_date, end_date, options)
 
     if data.ErrorCode != 0:
         raise RuntimeError(
@@ -60,9 +131,142 @@ def get_data_in_range(
         return None
 
     df = pd.DataFrame(
-        list(zip(*data.Data)),
+        dict(zip(indicators, data.Data)),
         columns=indicators,
-        index=pd.to_datetime(data.Times).strftime("%Y-%m-%d"),
+        index=pd.to_datetime(data.Times),
     )
     df.index.name = "date"
+    _write_cache(cache_path, df)
     return df
+
+
+def _wsd_batch(
+    instruments: List[str],
+    start_date: str,
+    end_date: str,
+    indicators: List[str],
+    options: str,
+) -> Dict[str, pd.DataFrame]:
+    """
+    每个指标请求一次，覆盖全部instruments；任何异常的返回都直接抛出RuntimeError，
+    由调用方决定如何降级。
+    """
+    columns = {sym: {} for sym in instruments}
+    index = None
+    for indicator in indicators:
+        data = _wind().wsd(
+            ",".join(instruments), indicator, start_date, end_date, options
+        )
+
+        if data.ErrorCode != 0:
+            raise RuntimeError(
+                f"Wind API error {data.ErrorCode} while fetching {indicator} "
+                f"for {len(instruments)} instruments"
+            )
+
+        if not data.Times or not data.Data:
+            raise RuntimeError(f"Wind API returned no data for {indicator}")
+
+        # 按返回的Codes对应数据行，代码与请求不一致时不做猜测
+        codes = list(data.Codes)
+        if (
+            len(codes) != len(data.Data)
+            or len(set(codes)) != len(codes)
+            or set(codes) != set(instruments)
+        ):
+            raise RuntimeError(
+                f"Wind API returned codes that do not match the request "
+                f"while fetching {indicator}"
+            )
+
+        times = pd.to_datetime(data.Times)
+        if index is None:
+            index = times
+        elif not index.equals(times):
+            raise RuntimeError(
+                f"Wind API returned inconsistent dates while fetching {indicator}"
+            )
+
+        for code, values in zip(codes, data.Data):
+            columns[code][indicator] = values
+
+    frames = {}
+    for sym, cols in columns.items():
+        df = pd.DataFrame(cols, columns=indicators, index=index)
+        df.index.name = "date"
+        frames[sym] = df
+    return frames
+
+
+def get_batch_in_range(
+    instruments: List[str],
+    start_date: str,
+    end_date: str,
+    indicators: List[str] = None,
+    options: str = "unit=1;TradingCalendar=NASDAQ;Currency=USD",
+) -> Dict[str, pd.DataFrame]:
+    """
+    Fetch historical data from Wind API for many instruments at once.
+
+    Wind's ``wsd`` only accepts multiple codes together with a single
+    indicator, so this issues one request per indicator for the whole
+    universe instead of one request per instrument. Instruments already in
+    the local cache are not requested again. If the batch request fails or
+    returns something unexpected, every uncached instrument is fetched on
+    its own with ``get_data_in_range`` so one bad code cannot sink the rest.
+
+    Parameters
+    ----------
+    instruments : List[str]
+        Instrument codes (e.g., ['AAPL.O', 'MSFT.O']).
+    start_date : str
+        Start date in 'YYYY-MM-DD' format.
+    end_date : str
+        End date in 'YYYY-MM-DD' format.
+    indicators : List[str], optional
+        List of indicators to fetch. Defaults to standard OHLCV set.
+    options : str, optional
+        Additional Wind API options string.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        Mapping of instrument code to a DataFrame shaped like the result of
+        ``get_data_in_range``. Instruments that could not be fetched are
+        omitted.
+    """
+    if indicators is None:
+        indicators = DEFAULT_INDICATORS
+    instruments = list(dict.fromkeys(instruments))
+    cache_paths = {
+        sym: _cache_path(sym, start_date, end_date, indicators, options)
+        for sym in instruments
+    }
+    frames = {}
+    missing = []
+    for sym in instruments:
+        cached = _read_cache(cache_paths[sym])
+        if cached is not None:
+            frames[sym] = cached
+        else:
+            missing.append(sym)
+    if not missing:
+        return frames
+
+    try:
+        fetched = _wsd_batch(missing, start_date, end_date, indicators, options)
+    except RuntimeError as e:
+        logger.warning(f"Batch fetch failed, falling back to per-instrument: {e}")
+        for sym in missing:
+            try:
+                df = get_data_in_range(sym, start_date, end_date, indicators, options)
+            except Exception as e:
+                logger.warning(f"Error fetching {sym}: {e}")
+                continue
+            if df is not None:
+                frames[sym] = df
+    else:
+        for sym, df in fetched.items():
+            _write_cache(cache_paths[sym], df)
+            frames[sym] = df
+    return {sym: frames[sym] for sym in instruments if sym in frames}